@@ -14,7 +14,7 @@ class TestHipsPainter:
     @classmethod
     def setup_class(cls):
         url = 'http://alasky.unistra.fr/DSS/DSS2Merged/properties'
-        cls.hips_survey = HipsSurveyProperties.fetch(url)
+        cls.hips_survey = HipsSurveyProperties.fetch(url, cache_path=None)
         cls.geometry = WCSGeometry.create(
             skydir=SkyCoord(0, 0, unit='deg', frame='icrs'),
             width=2000, height=1000, fov="3 deg",
@@ -58,7 +58,7 @@ make_sky_image_pars = [
 @remote_data
 @pytest.mark.parametrize('pars', make_sky_image_pars)
 def test_make_sky_image(tmpdir, pars):
-    hips_survey = HipsSurveyProperties.fetch(url=pars['url'])
+    hips_survey = HipsSurveyProperties.fetch(url=pars['url'], cache_path=None)
     geometry = make_test_wcs_geometry()
 
     fetch_opts = dict(fetch_package='urllib', timeout=30, n_parallel=10)
@@ -4,18 +4,22 @@ from typing import List
 from pathlib import Path
 
 __all__ = [
+    'tile_dir_index',
     'tile_default_url',
     'tile_default_path',
 ]
 
 
-def _tile_default_location(order: int, ipix: int, file_format: str) -> List[str]:
-    # Directory index: HiPS tiles are grouped in chunks of 10k tiles
-    dir_idx = (ipix // 10_000) * 10_000
+def tile_dir_index(ipix: int) -> int:
+    """Directory index of a tile (int), also works for arrays of ``ipix``."""
+    # HiPS tiles are grouped in chunks of 10k tiles
+    return (ipix // 10_000) * 10_000
+
 
+def _tile_default_location(order: int, ipix: int, file_format: str) -> List[str]:
     return [
         f'Norder{order}',
-        f'Dir{dir_idx}',
+        f'Dir{tile_dir_index(ipix)}',
         f'Npix{ipix}.{file_format}',
     ]
 
@@ -1,11 +1,23 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
 from io import StringIO
-from csv import DictWriter
 from pathlib import Path
+import urllib.error
 import urllib.request
-from typing import List, Union
-from astropy.table import Table
+from typing import List, Iterable, Union
+import numpy as np
+from astropy.table import Table, Column, MaskedColumn
+from astropy.utils import lazyproperty
 from .tile import HipsTileMeta
+from .io import tile_dir_index
 
 __all__ = [
     'HipsSurveyProperties',
@@ -17,14 +29,26 @@ __doctest_skip__ = [
     'HipsSurveyPropertiesList',
 ]
 
+DEFAULT_CACHE_PATH = '~/.cache/hips'
+"""Default directory for caching fetched HiPS properties."""
+
+DEFAULT_CACHE_TTL = 24 * 3600
+"""Default time in seconds that a cached HiPS survey list is used without revalidation."""
+
+# Property values that come from a small vocabulary
+_INTERNED_VALUE_KEYS = {'hips_frame', 'hips_tile_format', 'hips_version'}
+
 
 class HipsSurveyProperties:
     """HiPS properties container.
 
     Parameters
     ----------
-    data : `dict`
-        HiPS survey properties
+    data : `dict`, str or bytes
+        HiPS survey properties. If the properties text is given instead,
+        it is only decoded and parsed when ``data`` is first accessed.
+        Derived values such as `base_url` or `hips_order` are cached on
+        first access, so ``data`` should not be modified afterwards.
 
     Examples
     --------
@@ -41,14 +65,35 @@ class HipsSurveyProperties:
     }
     """HIPS to Astropy SkyCoord frame string mapping."""
 
-    def __init__(self, data: dict) -> None:
-        self.data = data
+    def __init__(self, data: Union[dict, str, bytes]) -> None:
+        if isinstance(data, (str, bytes)):
+            self._text = data
+        else:
+            self.data = data
+
+    @lazyproperty
+    def data(self) -> dict:
+        """HiPS survey properties (`dict`)."""
+        text = self._text
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', errors='ignore')
+        del self._text
+        return self._parse_text(text)
 
     @classmethod
-    def from_name(cls, name: str) -> 'HipsSurveyProperties':
-        """Create object from Survey ID (`HipsSurveyProperties`)."""
-        # TODO: implement some kind of caching for HipsSurveyPropertiesList
-        surveys = HipsSurveyPropertiesList.fetch()
+    def from_name(cls, name: str,
+                  cache_path: Union[str, Path] = DEFAULT_CACHE_PATH) -> 'HipsSurveyProperties':
+        """Create object from Survey ID (`HipsSurveyProperties`).
+
+        Parameters
+        ----------
+        name : str
+            HiPS survey ID
+        cache_path : str or `~pathlib.Path`
+            Directory where the HiPS survey list is cached,
+            see `HipsSurveyPropertiesList.fetch`.
+        """
+        surveys = HipsSurveyPropertiesList.fetch(cache_path=cache_path)
         return surveys.from_name(name)
 
     @classmethod
@@ -76,17 +121,19 @@ class HipsSurveyProperties:
         return cls.parse(text)
 
     @classmethod
-    def fetch(cls, url: str) -> 'HipsSurveyProperties':
+    def fetch(cls, url: str, cache_path: Union[str, Path] = DEFAULT_CACHE_PATH) -> 'HipsSurveyProperties':
         """Read from HiPS survey description file from remote URL (`HipsSurveyProperties`).
 
         Parameters
         ----------
         url : str
             URL containing HiPS properties
+        cache_path : str or `~pathlib.Path`
+            Directory where the response is cached and revalidated with
+            a conditional request. Use ``None`` to disable caching.
         """
-
-        with urllib.request.urlopen(url) as response:
-            text = response.read().decode('utf-8')
+        with _open_url(url, cache_path) as fh:
+            text = fh.read().decode('utf-8')
         return cls.parse(text, url)
 
     @classmethod
@@ -100,22 +147,32 @@ class HipsSurveyProperties:
         url : str
             Properties URL of HiPS
         """
+        data = cls._parse_text(text)
+        if url is not None:
+            data['properties_url'] = url.rsplit('/', 1)[0]
+
+        return cls(data)
+
+    @staticmethod
+    def _parse_text(text: str) -> dict:
         data = {}
-        for line in text.split('\n'):
+        for line in text.splitlines():
+            line = line.strip()
             # Skip empty or comment lines
             if line == '' or line.startswith('#'):
                 continue
-            try:
-                key, value = [_.strip() for _ in line.split('=', maxsplit=1)]
-                data[key] = value
-            except ValueError:
+            key, sep, value = line.partition('=')
+            if not sep:
                 # Skip bad lines (silently, might not be a good idea to do this)
                 continue
+            # Keys (and some values) repeat across surveys, interning saves memory
+            key = sys.intern(key.strip())
+            value = value.strip()
+            if key in _INTERNED_VALUE_KEYS:
+                value = sys.intern(value)
+            data[key] = value
 
-        if url is not None:
-            data['properties_url'] = url.rsplit('/', 1)[0]
-
-        return cls(data)
+        return data
 
     @property
     def title(self) -> str:
@@ -132,23 +189,20 @@ class HipsSurveyProperties:
         """HiPS coordinate frame (str)."""
         return self.data['hips_frame']
 
-    @property
+    @lazyproperty
     def astropy_frame(self) -> str:
         """Astropy coordinate frame (str)."""
         return self.hips_to_astropy_frame_mapping[self.hips_frame]
 
-    @property
+    @lazyproperty
     def hips_order(self) -> int:
         """HiPS order (int)."""
         return int(self.data['hips_order'])
 
-    @property
+    @lazyproperty
     def tile_width(self) -> int:
-        """HiPS tile width"""
-        try:
-            return int(self.data['hips_tile_width'])
-        except KeyError:
-            return 512
+        """HiPS tile width (int), defaults to 512 if missing or empty."""
+        return int(self.data.get('hips_tile_width') or 512)
 
     @property
     def tile_format(self) -> str:
@@ -160,7 +214,7 @@ class HipsSurveyProperties:
         """HiPS service base URL (str)."""
         return self.data['hips_service_url']
 
-    @property
+    @lazyproperty
     def base_url(self) -> str:
         """HiPS access URL"""
         try:
@@ -174,6 +228,38 @@ class HipsSurveyProperties:
                 except KeyError:
                     raise ValueError('URL does not exist!')
 
+    @lazyproperty
+    def _norder_url_prefix(self) -> str:
+        return f'{self.base_url}/Norder'
+
+    def tile_access_url(self, order: int, ipix: int) -> str:
+        """Tile directory URL on the server (str).
+
+        Parameters
+        ----------
+        order : int
+            HiPS order
+        ipix : int
+            HEALPix pixel index
+        """
+        return f'{self._norder_url_prefix}{order}/Dir{tile_dir_index(ipix)}/'
+
+    def tile_access_urls(self, order: int, ipix: np.ndarray) -> np.ndarray:
+        """Tile directory URLs on the server for many tiles (`~numpy.ndarray`).
+
+        Vectorised version of `tile_access_url`.
+
+        Parameters
+        ----------
+        order : int
+            HiPS order
+        ipix : `~numpy.ndarray`
+            HEALPix pixel indices
+        """
+        dir_idx = tile_dir_index(np.asarray(ipix))
+        urls = np.char.add(f'{self._norder_url_prefix}{order}/Dir', dir_idx.astype('U'))
+        return np.char.add(urls, '/')
+
     def tile_url(self, tile_meta: HipsTileMeta) -> str:
         """Tile URL on the server (str)."""
         return self.base_url + '/' + tile_meta.tile_default_url
@@ -249,24 +335,62 @@ class HipsSurveyPropertiesList:
         filename : str
             HiPS list filename
         """
-        with open(filename, encoding='utf-8', errors='ignore') as fh:
-            text = fh.read()
-
-        return cls.parse(text)
+        with open(filename, 'rb') as fh:
+            return cls._parse_lines(fh)
 
     @classmethod
-    def fetch(cls, url: str = None) -> 'HipsSurveyPropertiesList':
+    def fetch(cls, url: str = None,
+              cache_path: Union[str, Path] = DEFAULT_CACHE_PATH) -> 'HipsSurveyPropertiesList':
         """Fetch HiPS list text from remote location (`HipsSurveyPropertiesList`).
 
         Parameters
         ----------
         url : str
             HiPS list URL
+        cache_path : str or `~pathlib.Path`
+            Directory where the response is cached and revalidated with
+            a conditional request. A cached response is used without any
+            request for ``HIPS_CACHE_TTL`` seconds (environment variable,
+            default one day) after it was last fetched or revalidated.
+            Use ``None`` to disable caching.
         """
         url = url or cls.DEFAULT_URL
-        with urllib.request.urlopen(url) as response:
-            text = response.read().decode('utf-8', errors='ignore')
-        return cls.parse(text)
+        if cache_path is not None:
+            filename = _cache_filename(cache_path, url)
+            try:
+                if time.time() - filename.stat().st_mtime < _cache_ttl():
+                    _, fh = _read_cache(filename)
+                    with fh:
+                        return cls._parse_lines(fh)
+            except (OSError, ValueError):
+                # No usable cached response, fetch it
+                pass
+
+        with _open_url(url, cache_path) as response:
+            return cls._parse_lines(response)
+
+    @classmethod
+    def fetch_all(cls, urls: List[str], n_parallel: int = 16,
+                  cache_path: Union[str, Path] = DEFAULT_CACHE_PATH) -> 'HipsSurveyPropertiesList':
+        """Fetch many HiPS survey properties files in parallel (`HipsSurveyPropertiesList`).
+
+        Parameters
+        ----------
+        urls : list
+            URLs containing HiPS properties
+        n_parallel : int
+            Number of web requests to make in parallel
+        cache_path : str or `~pathlib.Path`
+            Directory where the responses are cached and revalidated with
+            a conditional request. Use ``None`` to disable caching.
+        """
+        def fetch(url):
+            return HipsSurveyProperties.fetch(url, cache_path)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_parallel) as executor:
+            data = list(executor.map(fetch, urls))
+
+        return cls(data)
 
     @classmethod
     def parse(cls, text: str) -> 'HipsSurveyPropertiesList':
@@ -277,10 +401,29 @@ class HipsSurveyPropertiesList:
         text : str
             HiPS list text
         """
+        return cls._parse_lines(StringIO(text))
+
+    @classmethod
+    def _parse_lines(cls, lines: Iterable[Union[str, bytes]]) -> 'HipsSurveyPropertiesList':
+        # Single pass over the lines (str or bytes), records are separated by empty lines.
+        # Each record is only decoded and parsed when its properties are accessed.
         data = []
-        for properties_text in text.split('\n\n'):
-            properties = HipsSurveyProperties.parse(properties_text)
-            data.append(properties)
+        record = []
+        newline = comment = None
+        for line in lines:
+            if newline is None:
+                newline, comment = ('\n', '#') if isinstance(line, str) else (b'\n', b'#')
+
+            line = line.strip()
+            if not line:
+                if record:
+                    data.append(HipsSurveyProperties(newline.join(record)))
+                    record = []
+            elif not line.startswith(comment):
+                record.append(line)
+
+        if record:
+            data.append(HipsSurveyProperties(newline.join(record)))
 
         return cls(data)
 
@@ -291,16 +434,14 @@ class HipsSurveyPropertiesList:
         # 1. Not all fields are present for the different surveys
         # 2. All data is stored as strings, numbers haven't been converted yet
         #
-        # It might not be the best solution, but the following code does the conversion
-        # by going via an intermediate CVS string, which Table can parse directly
-        rows = [properties.data for properties in self.data]
-        fieldnames = sorted({key for row in rows for key in row})
-        buffer = StringIO()
-        writer = DictWriter(buffer, fieldnames=fieldnames, dialect='unix')
-        writer.writeheader()
-        writer.writerows(rows)
-        txt = buffer.getvalue()
-        return Table.read(txt, format='ascii.csv', guess=False, fast_reader=False)
+        # We build the columns directly, masking missing fields and converting
+        # each column to the first type of (int, float, str) that works for all values
+        fieldnames = sorted({key for properties in self.data for key in properties.data})
+        columns = [
+            _make_column(name, [properties.data.get(name, '') for properties in self.data])
+            for name in fieldnames
+        ]
+        return Table(columns)
 
     def from_name(self, name: str) -> 'HipsSurveyProperties':
         """Return a matching HiPS survey (`HipsSurveyProperties`)."""
@@ -309,3 +450,176 @@ class HipsSurveyPropertiesList:
                 return survey
 
         raise KeyError(f'Survey not found: {name}')
+
+
+def _cache_filename(cache_path: Union[str, Path], url: str) -> Path:
+    """Cache filename for a given URL (without suffix)."""
+    return Path(cache_path).expanduser() / hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def _cache_ttl() -> float:
+    """Time in seconds a cached response is used without revalidation."""
+    try:
+        return float(os.environ.get('HIPS_CACHE_TTL', DEFAULT_CACHE_TTL))
+    except ValueError:
+        return DEFAULT_CACHE_TTL
+
+
+# Response headers used to revalidate a cached response, with the matching request header
+_CACHE_VALIDATORS = [
+    ('ETag', 'If-None-Match'),
+    ('Last-Modified', 'If-Modified-Since'),
+]
+
+
+@contextmanager
+def _open_url(url: str, cache_path: Union[str, Path] = None):
+    """Open URL for reading bytes.
+
+    The server may send a gzip-compressed response, which is decompressed here.
+    If ``cache_path`` is given, the response body is stored there together with
+    its ``ETag`` and ``Last-Modified`` headers. These are sent back on the next
+    request, and if the server answers "304 Not Modified" the cached body is used.
+    If the cache can't be used (e.g. read-only directory), the URL is read without it.
+    """
+    fh = None
+    if cache_path is not None:
+        try:
+            fh = _open_url_cached(url, _cache_filename(cache_path, url))
+        except _CacheError:
+            pass
+
+    if fh is None:
+        request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'})
+        with urllib.request.urlopen(request) as response:
+            yield _decompress(response)
+    else:
+        with fh:
+            yield fh
+
+
+def _open_url_cached(url: str, filename: Path):
+    """Open the cached response body for URL, fetching it unless it is not modified."""
+    request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'})
+    try:
+        headers, cached_fh = _read_cache(filename)
+    except (OSError, ValueError):
+        cached_fh = None
+    else:
+        for response_header, request_header in _CACHE_VALIDATORS:
+            if response_header in headers:
+                request.add_header(request_header, headers[response_header])
+
+    try:
+        with urllib.request.urlopen(request) as response:
+            headers = {
+                response_header: response.headers[response_header]
+                for response_header, _ in _CACHE_VALIDATORS
+                if response_header in response.headers
+            }
+            _write_cache(filename, headers, _decompress(response))
+        try:
+            return _read_cache(filename)[1]
+        except (OSError, ValueError) as error:
+            raise _CacheError(f'Cannot read cache file: {filename}') from error
+    except urllib.error.HTTPError as error:
+        if error.code == 304 and cached_fh is not None:
+            # Restart the time the cached response is used without revalidation
+            try:
+                os.utime(str(filename))
+            except OSError:
+                pass
+            fh, cached_fh = cached_fh, None
+            return fh
+        raise
+    finally:
+        if cached_fh is not None:
+            cached_fh.close()
+
+
+def _read_cache(filename: Path):
+    """Read cached response headers, returns them and the file positioned at the body."""
+    fh = filename.open('rb')
+    try:
+        headers = json.loads(fh.readline().decode('utf-8'))
+    except ValueError:
+        fh.close()
+        raise
+
+    return headers, fh
+
+
+def _write_cache(filename: Path, headers: dict, body) -> None:
+    """Write response headers and body to the cache.
+
+    Headers and body go to a single file, which is replaced atomically, so that
+    concurrent fetches never mix up the headers and body of different responses.
+    Errors reading ``body`` propagate, errors writing the cache raise `_CacheError`.
+    """
+    try:
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=str(filename.parent), prefix=filename.name, suffix='.tmp')
+    except OSError as error:
+        raise _CacheError(f'Cannot create cache file in: {filename.parent}') from error
+
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            _write_chunk(fh, json.dumps(headers).encode('utf-8') + b'\n')
+            while True:
+                chunk = body.read(64 * 1024)
+                if not chunk:
+                    break
+                _write_chunk(fh, chunk)
+            _write_chunk(fh, b'', flush=True)
+        try:
+            os.replace(tmp_filename, str(filename))
+        except OSError as error:
+            raise _CacheError(f'Cannot write cache file: {filename}') from error
+    except BaseException:
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+        raise
+
+
+def _write_chunk(fh, chunk: bytes, flush: bool = False) -> None:
+    try:
+        fh.write(chunk)
+        if flush:
+            fh.flush()
+    except OSError as error:
+        raise _CacheError(f'Cannot write cache file: {fh.name}') from error
+
+
+class _CacheError(Exception):
+    """The cache directory can't be used."""
+
+
+def _decompress(response):
+    """Wrap the response in a `gzip.GzipFile` if it is gzip-compressed."""
+    if response.headers.get('Content-Encoding') == 'gzip':
+        return gzip.GzipFile(fileobj=response)
+    else:
+        return response
+
+
+def _make_column(name: str, values: List[str]) -> Column:
+    """Make a table column from string values, empty strings are masked."""
+    values = np.array(values)
+    mask = values == ''
+    # Each conversion is a single vectorised pass over the column
+    filled = np.where(mask, '0', values)
+    for dtype in [np.int64, np.float64]:
+        try:
+            data = filled.astype(dtype)
+        except (ValueError, OverflowError):
+            continue
+        break
+    else:
+        data = values
+
+    if mask.any():
+        return MaskedColumn(data, name=name, mask=mask)
+    else:
+        return Column(data, name=name)
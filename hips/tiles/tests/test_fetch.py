@@ -41,7 +41,7 @@ def make_tile_metas(hips_survey, pars):
 @pytest.mark.parametrize('pars', TILE_FETCH_TEST_CASES)
 @remote_data
 def test_fetch_tiles(pars):
-    hips_survey = HipsSurveyProperties.fetch(pars['url'])
+    hips_survey = HipsSurveyProperties.fetch(pars['url'], cache_path=None)
 
     tile_metas = list(make_tile_metas(hips_survey, pars))
 
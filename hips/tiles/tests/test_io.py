@@ -1,6 +1,11 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from pathlib import Path
-from ..io import tile_default_url, tile_default_path
+from ..io import tile_dir_index, tile_default_url, tile_default_path
+
+
+def test_tile_dir_index():
+    assert tile_dir_index(54321) == 50000
+    assert tile_dir_index(9999) == 0
 
 
 def test_tile_default_url():
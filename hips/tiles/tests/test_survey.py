@@ -1,11 +1,20 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
+import gzip
+import http.server
+import os
+import socket
+import threading
+import urllib.request
+from io import BytesIO
+from pathlib import Path
 import pytest
+import numpy as np
 from numpy.testing import assert_allclose
 from astropy.utils.data import get_pkg_data_filename
 from astropy.tests.helper import remote_data
 from ...utils.testing import get_hips_extra_file, requires_hips_extra
 from ..tile import HipsTileMeta
-from ..survey import HipsSurveyProperties, HipsSurveyPropertiesList
+from ..survey import HipsSurveyProperties, HipsSurveyPropertiesList, _open_url, _read_cache
 
 
 class TestHipsSurveyProperties:
@@ -16,15 +25,33 @@ class TestHipsSurveyProperties:
 
     @remote_data
     def test_from_name(self):
-        survey = HipsSurveyProperties.from_name('CDS/P/2MASS/color')
+        survey = HipsSurveyProperties.from_name('CDS/P/2MASS/color', cache_path=None)
         assert survey.title == '2MASS color J (1.23um), H (1.66um), K (2.16um)'
 
     @remote_data
-    def test_make(self):
+    def test_make(self, tmpdir, monkeypatch):
+        # Keep the default cache used by `from_name` out of the real home directory
+        monkeypatch.setenv('HOME', str(tmpdir))
         survey = HipsSurveyProperties.make('CDS/P/EGRET/Dif/300-500')
         assert survey.title == 'EGRET Dif 300-500MeV'
         assert self.survey is HipsSurveyProperties.make(self.survey)
 
+    @staticmethod
+    def test_parse():
+        text = '# comment\nobs_title = a=b\nbad line\nhips_order = 3\n'
+        survey = HipsSurveyProperties.parse(text)
+        assert survey.data == {'obs_title': 'a=b', 'hips_order': '3'}
+
+    @staticmethod
+    def test_lazy_parse():
+        survey = HipsSurveyProperties('obs_title = DSS\nhips_order = 9')
+        assert 'data' not in survey.__dict__
+        assert survey.hips_order == 9
+        assert survey.data == {'obs_title': 'DSS', 'hips_order': '9'}
+
+        survey = HipsSurveyProperties(b'obs_title = DSS')
+        assert survey.title == 'DSS'
+
     def test_title(self):
         assert self.survey.title == 'DSS colored'
 
@@ -47,11 +74,27 @@ class TestHipsSurveyProperties:
         expected = 'http://alasky.u-strasbg.fr/DSS/DSSColor'
         assert self.survey.base_url == expected
 
+    def test_tile_access_url(self):
+        url = self.survey.tile_access_url(order=9, ipix=54321)
+        assert url == 'http://alasky.u-strasbg.fr/DSS/DSSColor/Norder9/Dir50000/'
+
+    def test_tile_access_urls(self):
+        urls = self.survey.tile_access_urls(order=9, ipix=np.array([123, 54321]))
+        assert list(urls) == [
+            'http://alasky.u-strasbg.fr/DSS/DSSColor/Norder9/Dir0/',
+            'http://alasky.u-strasbg.fr/DSS/DSSColor/Norder9/Dir50000/',
+        ]
+
     def test_tile_default_url(self):
         tile_meta = HipsTileMeta(order=9, ipix=54321, file_format='fits')
         url = self.survey.tile_url(tile_meta)
         assert url == 'http://alasky.u-strasbg.fr/DSS/DSSColor/Norder9/Dir50000/Npix54321.fits'
 
+    @staticmethod
+    def test_tile_width_default():
+        assert HipsSurveyProperties({}).tile_width == 512
+        assert HipsSurveyProperties({'hips_tile_width': ''}).tile_width == 512
+
     @staticmethod
     @requires_hips_extra()
     def test_tile_width():
@@ -63,7 +106,7 @@ class TestHipsSurveyProperties:
     @remote_data
     def test_fetch():
         url = 'http://alasky.u-strasbg.fr/DSS/DSS2-NIR/properties'
-        survey = HipsSurveyProperties.fetch(url)
+        survey = HipsSurveyProperties.fetch(url, cache_path=None)
         assert survey.base_url == 'http://alasky.u-strasbg.fr/DSS/DSS2-NIR'
 
 
@@ -81,6 +124,13 @@ class TestHipsSurveyPropertiesList:
         assert survey.data['obs_collection'] == 'MUSE-M42'
         assert survey.data['hips_tile_format'] == 'png fits'
 
+    @staticmethod
+    def test_parse():
+        text = Path(get_pkg_data_filename('data/surveys.txt')).read_text(encoding='utf-8')
+        surveys = HipsSurveyPropertiesList.parse(text)
+        assert len(surveys.data) == 4
+        assert surveys.data[0].data['ID'] == 'CDS/C/MUSE-M42'
+
     def test_table(self):
         table = self.surveys.table
         assert len(table) == 4
@@ -92,9 +142,50 @@ class TestHipsSurveyPropertiesList:
         assert row['moc_order'] == 12
         assert_allclose(row['moc_sky_fraction'], 2.98e-07, rtol=0.01)
 
+        # Fields not present for all surveys are masked
+        assert table['client_category'].mask[0]
+        assert table['client_category'][1] == 'Image/Infrared/2MASS'
+
+    @staticmethod
+    def test_fetch_all(tmpdir):
+        urls = []
+        for title in ['a', 'b', 'c']:
+            path = Path(str(tmpdir)) / title / 'properties'
+            path.parent.mkdir()
+            path.write_text(f'obs_title = {title}\n')
+            urls.append(path.as_uri())
+
+        surveys = HipsSurveyPropertiesList.fetch_all(urls, n_parallel=2, cache_path=None)
+        assert [survey.title for survey in surveys.data] == ['a', 'b', 'c']
+
+    @staticmethod
+    def test_fetch_cache(tmpdir, monkeypatch):
+        path = Path(str(tmpdir)) / 'surveys.txt'
+        path.write_bytes(Path(get_pkg_data_filename('data/surveys.txt')).read_bytes())
+        cache_path = Path(str(tmpdir)) / 'cache'
+
+        surveys = HipsSurveyPropertiesList.fetch(path.as_uri(), cache_path=cache_path)
+        assert len(surveys.data) == 4
+
+        # Within the TTL the cached response is used, without reading the URL
+        path.unlink()
+        surveys = HipsSurveyPropertiesList.fetch(path.as_uri(), cache_path=cache_path)
+        assert len(surveys.data) == 4
+        assert 'data' not in surveys.data[0].__dict__
+        assert surveys.data[0].data['ID'] == 'CDS/C/MUSE-M42'
+
+        # An invalid TTL falls back to the default
+        monkeypatch.setenv('HIPS_CACHE_TTL', 'one day')
+        surveys = HipsSurveyPropertiesList.fetch(path.as_uri(), cache_path=cache_path)
+        assert len(surveys.data) == 4
+
+        monkeypatch.setenv('HIPS_CACHE_TTL', '0')
+        with pytest.raises(OSError):
+            HipsSurveyPropertiesList.fetch(path.as_uri(), cache_path=cache_path)
+
     @remote_data
     def test_fetch(self):
-        surveys = HipsSurveyPropertiesList.fetch()
+        surveys = HipsSurveyPropertiesList.fetch(cache_path=None)
         assert len(surveys.data) > 3
 
         survey = surveys.from_name('CDS/P/2MASS/H')
@@ -104,5 +195,151 @@ class TestHipsSurveyPropertiesList:
     @remote_data
     def test_key_error(self):
         with pytest.raises(KeyError):
-            surveys = HipsSurveyPropertiesList.fetch()
+            surveys = HipsSurveyPropertiesList.fetch(cache_path=None)
             surveys.from_name('Kronka Lonka')
+
+
+class ETagHandler(http.server.BaseHTTPRequestHandler):
+    """Serves a fixed body with an ETag and answers 304 if it matches."""
+    body = b'obs_title = DSS colored\n'
+    etag = '"v1"'
+    statuses = []
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.statuses.append(200)
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class GzipResponse(BytesIO):
+    """Fake `urllib.request.urlopen` response with a gzip-compressed body."""
+    def __init__(self, body: bytes) -> None:
+        super().__init__(gzip.compress(body))
+        self.headers = {'Content-Encoding': 'gzip'}
+
+
+class BrokenResponse(BytesIO):
+    """Fake `urllib.request.urlopen` response that fails while reading the body."""
+    def __init__(self, error: Exception, headers: dict = None) -> None:
+        super().__init__()
+        self.error = error
+        self.headers = headers or {}
+
+    def read(self, *args):
+        raise self.error
+
+
+class TestOpenUrl:
+    @classmethod
+    def setup_class(cls):
+        cls.server = http.server.HTTPServer(('localhost', 0), ETagHandler)
+        cls.url = f'http://localhost:{cls.server.server_port}/properties'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_not_modified(self, tmpdir):
+        ETagHandler.statuses.clear()
+        for _ in range(2):
+            with _open_url(self.url, cache_path=tmpdir) as fh:
+                assert fh.read() == ETagHandler.body
+
+            # Revalidation restarts the cache TTL
+            cached = Path(str(tmpdir.listdir()[0]))
+            assert cached.stat().st_mtime > 0
+            os.utime(str(cached), (0, 0))
+
+        assert ETagHandler.statuses == [200, 304]
+
+    @staticmethod
+    @pytest.mark.parametrize('cached', [False, True])
+    def test_gzip(tmpdir, monkeypatch, cached):
+        body = b'obs_title = DSS colored\n'
+        monkeypatch.setattr(urllib.request, 'urlopen', lambda request: GzipResponse(body))
+
+        cache_path = tmpdir if cached else None
+        with _open_url('http://localhost/properties', cache_path=cache_path) as fh:
+            assert fh.read() == body
+
+        assert len(tmpdir.listdir()) == int(cached)
+
+    @staticmethod
+    @pytest.mark.parametrize('error', [ConnectionResetError(), socket.timeout()])
+    def test_body_error(tmpdir, monkeypatch, error):
+        # Errors reading the response are not cache errors, the URL isn't requested again
+        requests = []
+
+        def urlopen(request):
+            requests.append(request)
+            return BrokenResponse(error)
+
+        monkeypatch.setattr(urllib.request, 'urlopen', urlopen)
+        with pytest.raises(type(error)):
+            with _open_url('http://localhost/properties', cache_path=tmpdir):
+                pass
+
+        assert len(requests) == 1
+        assert tmpdir.listdir() == []
+
+    @staticmethod
+    def test_bad_gzip(tmpdir, monkeypatch):
+        requests = []
+
+        def urlopen(request):
+            requests.append(request)
+            response = BytesIO(b'not gzip')
+            response.headers = {'Content-Encoding': 'gzip'}
+            return response
+
+        monkeypatch.setattr(urllib.request, 'urlopen', urlopen)
+        with pytest.raises(OSError):
+            with _open_url('http://localhost/properties', cache_path=tmpdir):
+                pass
+
+        assert len(requests) == 1
+
+    @staticmethod
+    def test_cache(tmpdir):
+        filename = get_pkg_data_filename('data/properties.txt')
+        url = Path(filename).as_uri()
+
+        with _open_url(url, cache_path=tmpdir) as fh:
+            text = fh.read()
+
+        assert text == Path(filename).read_bytes()
+        cached = [path for path in Path(str(tmpdir)).iterdir()]
+        assert len(cached) == 1
+        headers, fh = _read_cache(cached[0])
+        with fh:
+            assert fh.read() == text
+
+    @staticmethod
+    def test_cache_concurrent(tmpdir):
+        url = Path(get_pkg_data_filename('data/properties.txt')).as_uri()
+        surveys = HipsSurveyPropertiesList.fetch_all([url] * 8, n_parallel=8, cache_path=tmpdir)
+        assert [survey.title for survey in surveys.data] == ['DSS colored'] * 8
+
+    @staticmethod
+    def test_cache_not_writable(tmpdir):
+        # A file where the cache directory should be, the cache can't be used
+        cache_path = Path(str(tmpdir)) / 'cache'
+        cache_path.write_text('')
+        filename = get_pkg_data_filename('data/properties.txt')
+
+        with _open_url(Path(filename).as_uri(), cache_path=cache_path / 'hips') as fh:
+            assert fh.read() == Path(filename).read_bytes()